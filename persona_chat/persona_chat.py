@@ -5,64 +5,146 @@ Features: Editable prompts, Start/Stop controls, Google TTS voice output.
 """
 
 import os
+import re
+import json
 import time
-import tempfile
+import base64
+import asyncio
 import threading
+from uuid import uuid4
 from pathlib import Path
+from datetime import timedelta
+from collections import OrderedDict, deque
 
+import httpx
+import numpy as np
 import gradio as gr
+import websockets  # >= 14: the asyncio client that accepts additional_headers
 import google.generativeai as genai
-from elevenlabs.client import ElevenLabs
+import google.ai.generativelanguage as glm
+from elevenlabs.client import AsyncElevenLabs
 
 # Try to load from .env file
+# Horizontal whitespace only (plus CRLF endings), so an empty value can't swallow the next line
+ENV_LINE_RE = re.compile(r"""^[ \t]*([A-Za-z_][A-Za-z0-9_]*)[ \t]*=[ \t]*["']?(.*?)["']?[ \t\r]*$""", re.M)
+
+def parse_env(text: str) -> list:
+    """Parse KEY=value pairs from .env text.
+
+    >>> parse_env('FOO=\\nBAR="baz"\\n')
+    [('FOO', ''), ('BAR', 'baz')]
+    """
+    return ENV_LINE_RE.findall(text)
+
 def load_env_file():
-    """Load environment variables from .env file if it exists."""
+    """Load environment variables from .env file if it exists (shell variables take precedence)."""
     env_path = Path(__file__).parent / ".env"
     if env_path.exists():
-        with open(env_path, "r") as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    key = key.strip()
-                    value = value.strip().strip('"').strip("'")
-                    os.environ[key] = value
+        for key, value in parse_env(env_path.read_text()):
+            os.environ.setdefault(key, value)
 
 load_env_file()
 
 # Global model instance (configured later if API key provided via UI)
+GEMINI_MODEL = "gemini-2.0-flash"
 model = None
 
+# Per-persona models backed by Gemini context caches of the system prompt
+CACHED_MODEL = "models/gemini-2.0-flash-001"  # Context caching needs a pinned version
+PROMPT_CACHE_TTL = timedelta(hours=1)
+CACHE_MIN_TOKENS = 4096  # Gemini rejects explicit caches smaller than this
+CACHE_RETRY_INTERVAL = 60  # Seconds before retrying after a failed count or cache creation
+persona_models = {}  # (persona_name, prompt hash) -> (GenerativeModel, expiry time)
+
 def get_api_key():
     """Get API key from environment."""
     return os.environ.get("GEMINI_API_KEY", "")
 
 def configure_gemini(api_key: str) -> tuple[bool, str]:
     """Configure Gemini with the provided API key."""
-    global model
+    global model, persona_models
     if not api_key or not api_key.strip():
         return False, "API key is empty"
+    api_key = api_key.strip()
     try:
-        genai.configure(api_key=api_key.strip())
-        model = genai.GenerativeModel("gemini-2.0-flash")
-        # Test the connection with a simple request
-        model.generate_content("Hello")
-        os.environ["GEMINI_API_KEY"] = api_key.strip()
-        return True, "API key configured successfully!"
+        # Test the key on its own client; genai.configure would switch the whole
+        # process, including turns already running, over to an unverified key
+        test_client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        test_client.generate_content(
+            model=f"models/{GEMINI_MODEL}",
+            contents=[glm.Content(parts=[glm.Part(text="Hello")])]
+        )
     except Exception as e:
-        model = None
         return False, f"Failed to configure API: {str(e)}"
 
+    # Only a verified key reaches the process-wide configuration
+    genai.configure(api_key=api_key)
+    persona_models = {}  # Context caches belong to the previous key
+    model = genai.GenerativeModel(GEMINI_MODEL)
+    os.environ["GEMINI_API_KEY"] = api_key
+    return True, "API key configured successfully!"
+
+async def get_persona_model(base_model, models: dict, persona_name: str, system_prompt: str):
+    """Return a model with the persona's system prompt cached on Gemini's side."""
+    key = (persona_name, hash(system_prompt))
+    entry = models.get(key)
+    if entry is not None and entry[1] > time.monotonic():
+        return entry[0]
+
+    # Only prompts above the caching minimum are worth a server-side cache
+    failed = False
+    try:
+        prompt_tokens = (await base_model.count_tokens_async(system_prompt)).total_tokens
+    except Exception as e:
+        print(f"Token count failed for {persona_name}: {e}")
+        prompt_tokens = 0
+        failed = True
+
+    persona_model = None
+    if prompt_tokens >= CACHE_MIN_TOKENS:
+        try:
+            cached = await asyncio.to_thread(
+                genai.caching.CachedContent.create,
+                model=CACHED_MODEL,
+                display_name=persona_name,
+                system_instruction=system_prompt,
+                ttl=PROMPT_CACHE_TTL
+            )
+            persona_model = genai.GenerativeModel.from_cached_content(cached)
+            # Refresh a little before the server-side cache expires
+            expiry = time.monotonic() + PROMPT_CACHE_TTL.total_seconds() - 60
+        except Exception as e:
+            print(f"Context cache unavailable for {persona_name}: {e}")
+            failed = True
+
+    if persona_model is None:
+        # Short prompts go in as a plain system instruction, which never expires;
+        # after a failure it is only a stopgap until the next retry
+        persona_model = genai.GenerativeModel(base_model.model_name, system_instruction=system_prompt)
+        expiry = time.monotonic() + CACHE_RETRY_INTERVAL if failed else float("inf")
+
+    models[key] = (persona_model, expiry)
+    return persona_model
+
 # Try to configure from environment on startup
 initial_key = get_api_key()
 if initial_key:
     configure_gemini(initial_key)
 
+# Shared HTTP/2 connection pool for the ElevenLabs SDK, kept alive for the whole
+# process. It only serves the REST fallback; regular turns go over the per-voice
+# websockets (see VoiceSocket), which keep their own connections open.
+_HTTP = httpx.AsyncClient(
+    http2=True,
+    timeout=30,
+    limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=300)
+)
+
 # Initialize ElevenLabs client
 eleven_client = None
 ELEVEN_API_KEY = os.environ.get("ELEVEN_API_KEY", "")
 if ELEVEN_API_KEY:
-    eleven_client = ElevenLabs(api_key=ELEVEN_API_KEY)
+    eleven_client = AsyncElevenLabs(api_key=ELEVEN_API_KEY, httpx_client=_HTTP)
 
 # Voice IDs for different personas (ElevenLabs voices)
 # Female voice for Priya, Male voice for Rajesh
@@ -71,6 +153,38 @@ VOICE_IDS = {
     "male": "1wR0NchtHfKujrd8xFsX" #Pranav Shah  "29vD33N1CtxCmqQRPOHJ",     # Drew - male voice
 }
 
+# Persona name -> voice ID, filled in when a conversation starts
+PERSONA_VOICE = {}
+
+
+def assign_voices(persona_a_name: str, persona_b_name: str):
+    """Map the configured persona names to their voices (female for A, male for B)."""
+    PERSONA_VOICE[persona_a_name] = VOICE_IDS["female"]
+    PERSONA_VOICE[persona_b_name] = VOICE_IDS["male"]
+
+# ElevenLabs synthesis settings shared by the websocket and REST paths
+ELEVEN_MODEL_ID = "eleven_turbo_v2_5"  # Faster model, good quality
+ELEVEN_OUTPUT_FORMAT = "mp3_44100_128"
+MP3_BYTES_PER_SECOND = 128000 // 8  # 128 kbps CBR
+VOICE_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.75,
+    "style": 0.0,
+    "speed": 1.15  # Slightly faster speech
+}
+# Latency optimization level (0-4); 4 also skips the text normalizer, which is
+# fine for Rajesh's short replies where minor mispronunciations don't matter
+ELEVEN_LATENCY_MODE = 3
+ELEVEN_LATENCY_MODE_SHORT = 4
+# One multi-context websocket per voice is kept open between turns; each utterance
+# is its own context, so only the first turn per voice pays the TLS/websocket handshake
+ELEVEN_WS_INACTIVITY_TIMEOUT = 180  # Seconds the server keeps an idle socket open (max 180)
+ELEVEN_WS_URL = (
+    "wss://api.elevenlabs.io/v1/text-to-speech/{voice_id}/multi-stream-input"
+    "?model_id={model_id}&output_format={output_format}"
+    "&optimize_streaming_latency={latency_mode}&inactivity_timeout={inactivity_timeout}"
+)
+
 # Default Persona Definitions
 DEFAULT_PERSONA_A = {
     "name": "Priya Sharma",
@@ -124,54 +238,241 @@ Respond naturally to Priya's recovery call.
 """
 }
 
+# Batch Mode (offline transcript generation)
+BATCH_POLL_INTERVAL = 10  # Seconds between job status checks
+BATCH_TIMEOUT = 30 * 60  # Seconds to wait for a job before cancelling it
+BATCH_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
 # Global State
 conversation_history = []
+_formatted_messages = []  # Chatbot view of conversation_history, appended in step with it
+AUDIO_RETENTION_TURNS = 10  # Messages that keep their audio for instant replay
+audio_messages = deque(maxlen=AUDIO_RETENTION_TURNS)
 running = False
-stop_event = threading.Event()
-audio_files = []  # Track audio files for cleanup
+stop_event = asyncio.Event()
+
+# Response cache: exact repeats hit an LRU, near-duplicates hit an embedding search.
+# Entries are tied to the recent turns, so a repeated line alone can't replay a reply,
+# and to the current run, so a new conversation never replays an earlier one.
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+SEMANTIC_CACHE_THRESHOLD = 0.9  # Cosine similarity needed to reuse a response
+SEMANTIC_CACHE_SIZE = 512  # Entries kept per persona
+CACHE_CONTEXT_TURNS = 4  # Recent messages a cached reply must share
+background_tasks = set()  # Keeps fire-and-forget tasks alive until they finish
+cache_run_id = None  # Set per live run; scopes the response caches to it
+
+
+class LRUCache:
+    """Small thread-safe mapping that evicts the least recently used entry."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class SemanticCache:
+    """Fixed-size ring of message embeddings and replies, searched by cosine similarity."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._vectors = None
+        self._contexts = np.zeros(maxsize, dtype=np.int64)
+        self._responses = [None] * maxsize
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def has_context(self, context: int) -> bool:
+        """Whether any entry was stored with the same preceding turns."""
+        with self._lock:
+            size = min(self._count, self.maxsize)
+            return bool(np.any(self._contexts[:size] == context))
+
+    def lookup(self, query: np.ndarray, context: int) -> str | None:
+        """Return the reply whose message is closest to the query, if close enough."""
+        with self._lock:
+            size = min(self._count, self.maxsize)
+            if size == 0:
+                return None
+            scores = self._vectors[:size] @ query
+            # Only entries with the same preceding turns are candidates
+            scores[self._contexts[:size] != context] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] > SEMANTIC_CACHE_THRESHOLD:
+                return self._responses[best]
+            return None
+
+    def store(self, query: np.ndarray, context: int, response: str):
+        """Add an entry in place, overwriting the oldest once full."""
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.maxsize, query.size), dtype=np.float32)
+            slot = self._count % self.maxsize
+            self._vectors[slot] = query
+            self._contexts[slot] = context
+            self._responses[slot] = response
+            self._count += 1
+
+
+response_cache = LRUCache(maxsize=512)  # (run id, persona_name, prompt hash, recent turns hash) -> response
+semantic_cache = LRUCache(maxsize=16)  # (run id, persona_name, prompt hash) -> SemanticCache
+replay_cache = LRUCache(maxsize=32)  # (persona_name, message) -> audio for messages without stored audio
+
+# Context window: recent messages go in verbatim, older ones as a rolling summary
+HISTORY_WINDOW = 8
+SUMMARY_INTERVAL = 10
+summary_cache = LRUCache(maxsize=64)  # hash of summarized messages -> summary
+
+
+async def embed_text(text: str) -> np.ndarray:
+    """Embed text with Gemini and return it as a unit vector."""
+    result = await genai.embed_content_async(
+        model=EMBEDDING_MODEL,
+        content=text,
+        task_type="semantic_similarity"
+    )
+    vector = np.asarray(result["embedding"], dtype=np.float32)
+    return vector / np.linalg.norm(vector)
 
 
-def generate_response(persona_name: str, system_prompt: str, history: list, last_message: str) -> str:
-    """Generate a response from Gemini for the given persona."""
-    global model
-    if model is None:
-        return "[Error: Gemini API not configured. Please enter your API key.]"
+def history_hash(messages: list) -> int:
+    """Hash a run of messages by speaker and content."""
+    return hash(tuple((msg["name"], msg["content"]) for msg in messages))
 
-    # Build the conversation context
-    messages_text = f"System: {system_prompt}\n\n"
-    messages_text += "Conversation so far:\n"
-    for msg in history:
-        messages_text += f"{msg['name']}: {msg['content']}\n"
-    messages_text += f"\nYou are {persona_name}. Respond to the last message naturally. Keep your response short (2-3 sentences max)."
 
+async def store_semantic_cache(cache_key: tuple, message: str, context: int, response: str):
+    """Embed a message and add it with its reply to the persona's semantic cache."""
     try:
-        response = model.generate_content(messages_text)
-        return response.text.strip()
+        query = await embed_text(message)
     except Exception as e:
-        return f"[Error generating response: {str(e)}]"
+        print(f"Embedding error: {e}")
+        return
+    store = semantic_cache.get(cache_key)
+    if store is None:
+        store = SemanticCache(SEMANTIC_CACHE_SIZE)
+        semantic_cache.put(cache_key, store)
+    store.store(query, context, response)
+
+
+def build_prompt(persona_name: str, history: list, summary: str = "") -> str:
+    """Build the per-turn prompt from the conversation so far."""
+    parts = [f"Summary so far: {summary}", ""] if summary else []
+    parts += ["Conversation so far:"]
+    parts += [f"{msg['name']}: {msg['content']}" for msg in history]
+    parts += ["", f"You are {persona_name}. Respond to the last message naturally. Keep your response short (2-3 sentences max)."]
+    return "\n".join(parts)
+
+
+async def summarize_history(base_model, older: list) -> str:
+    """Return a rolling one-line summary of older messages, extended SUMMARY_INTERVAL at a time."""
+    if not older:
+        return ""
+    key = hash(tuple((msg["name"], msg["content"]) for msg in older))
+    summary = summary_cache.get(key)
+    if summary is not None:
+        return summary
+
+    previous = await summarize_history(base_model, older[:-SUMMARY_INTERVAL])
+    lines = "\n".join(f"{msg['name']}: {msg['content']}" for msg in older[-SUMMARY_INTERVAL:])
+    prompt = (
+        f"Summary so far: {previous or '(start of call)'}\n\n"
+        f"Next lines of the call:\n{lines}\n\n"
+        "Update the summary in one short line, keeping amounts, commitments and the mood of the call."
+    )
+    response = await base_model.generate_content_async(prompt)
+    summary = response.text.strip()
+    summary_cache.put(key, summary)
+    return summary
+
+
+async def stream_response(persona_name: str, system_prompt: str, history: list, last_message: str):
+    """Stream a response from Gemini for the given persona, yielding text chunks as they arrive."""
+    # Capture the configured model once so a reconfiguration mid-turn can't swap it out
+    local_model, local_persona_models = model, persona_models
+    if local_model is None:
+        yield "[Error: Gemini API not configured. Please enter your API key.]"
+        return
+
+    # Check the caches before paying for a generation; both are keyed on the run and
+    # the recent turns, not just the last line, so a repeated line doesn't lock the call in a loop
+    cache_key = (cache_run_id, persona_name, hash(system_prompt))
+    exact_key = cache_key + (history_hash(history[-CACHE_CONTEXT_TURNS:]),)
+    context = history_hash(history[-CACHE_CONTEXT_TURNS:-1])
+    # A reply already said in this call would start the call repeating itself
+    said = {msg["content"] for msg in history}
+    cached = response_cache.get(exact_key)
+    if cached is not None and cached not in said:
+        yield cached
+        return
+
+    # Only pay for an embedding when there is an entry it could match
+    store = semantic_cache.get(cache_key)
+    if last_message and store is not None and store.has_context(context):
+        try:
+            cached = store.lookup(await embed_text(last_message), context)
+        except Exception as e:
+            print(f"Embedding error: {e}")
+        if cached is not None and cached not in said:
+            response_cache.put(exact_key, cached)
+            yield cached
+            return
+
+    # Send only the recent turns verbatim; older ones travel as a rolling summary that
+    # is extended every SUMMARY_INTERVAL messages, so the window holds 8-17 messages
+    cut = max(0, (len(history) - HISTORY_WINDOW) // SUMMARY_INTERVAL * SUMMARY_INTERVAL)
+    try:
+        summary = await summarize_history(local_model, history[:cut])
+    except Exception as e:
+        print(f"Summary error: {e}")
+        summary = ""
 
+    # Build the conversation context (the system prompt lives in the cached model)
+    messages_text = build_prompt(persona_name, history[cut:], summary)
 
-def get_audio_duration(filepath: str, text: str = "") -> float:
-    """Get the duration of an audio file in seconds."""
-    # Method 1: Try mutagen
+    parts = []
     try:
-        from mutagen.mp3 import MP3
-        audio = MP3(filepath)
-        return audio.info.length
-    except:
-        pass
+        persona_model = await get_persona_model(local_model, local_persona_models, persona_name, system_prompt)
+        response = await persona_model.generate_content_async(
+            messages_text,
+            stream=True
+        )
+        async for chunk in response:
+            parts.append(chunk.text)
+            yield chunk.text
+    except Exception as e:
+        yield f"[Error generating response: {str(e)}]"
+        return
 
-    # Method 2: Try getting file size and estimate (MP3 at 128kbps = 16KB per second)
-    try:
-        file_size = os.path.getsize(filepath)
-        # 128kbps = 16000 bytes per second
-        duration = file_size / 16000
-        if duration > 0:
-            return duration
-    except:
-        pass
-
-    # Method 3: Estimate based on text length
+    text = "".join(parts).strip()
+    response_cache.put(exact_key, text)
+    if last_message:
+        # Embed off the turn's critical path
+        task = asyncio.create_task(store_semantic_cache(cache_key, last_message, context, text))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+def get_audio_duration(num_bytes: int, text: str = "") -> float:
+    """Get the duration of an MP3 clip in seconds from its size in bytes."""
+    # Method 1: The output format is constant-bitrate MP3, so size maps exactly to time
+    if num_bytes > 0:
+        return num_bytes / MP3_BYTES_PER_SECOND
+
+    # Method 2: Estimate based on text length
     # ElevenLabs speaks at roughly 150-180 words per minute (~2.7 words per second)
     if text:
         word_count = len(text.split())
@@ -180,192 +481,340 @@ def get_audio_duration(filepath: str, text: str = "") -> float:
     return 3.0  # Default fallback
 
 
-def text_to_speech(text: str, persona_name: str) -> tuple[str, float]:
-    """Convert text to speech using ElevenLabs and return the audio file path and duration."""
+def latency_mode_for(voice_id: str) -> int:
+    """Pick the ElevenLabs latency optimization level for a voice."""
+    if voice_id == VOICE_IDS["male"]:
+        return ELEVEN_LATENCY_MODE_SHORT
+    return ELEVEN_LATENCY_MODE
+
+
+class VoiceSocket:
+    """A reusable ElevenLabs multi-context websocket for one voice."""
+
+    def __init__(self, voice_id: str):
+        self.voice_id = voice_id
+        self._ws = None
+        self._reader = None
+        self._contexts = {}  # context id -> queue of server messages
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        """Return the open socket, reconnecting if the server closed it."""
+        async with self._lock:
+            if self._ws is None:
+                url = ELEVEN_WS_URL.format(
+                    voice_id=self.voice_id,
+                    model_id=ELEVEN_MODEL_ID,
+                    output_format=ELEVEN_OUTPUT_FORMAT,
+                    latency_mode=latency_mode_for(self.voice_id),
+                    inactivity_timeout=ELEVEN_WS_INACTIVITY_TIMEOUT
+                )
+                self._ws = await websockets.connect(url, additional_headers={"xi-api-key": ELEVEN_API_KEY})
+                self._reader = asyncio.create_task(self._read(self._ws))
+            return self._ws
+
+    async def _read(self, ws):
+        """Route server messages to the context they belong to."""
+        try:
+            async for message in ws:
+                data = json.loads(message)
+                queue = self._contexts.get(data.get("contextId"))
+                if queue is not None:
+                    queue.put_nowait(data)
+        except Exception as e:
+            print(f"ElevenLabs socket closed: {e}")
+        finally:
+            if self._ws is ws:
+                self._ws = None
+            # Wake every context still waiting on this socket
+            for queue in self._contexts.values():
+                queue.put_nowait(None)
+
+    async def stream(self, text_chunks):
+        """Yield MP3 chunks for the text as the server produces them.
+
+        Text is forwarded chunk by chunk while it is still being produced, so
+        synthesis overlaps with generation.
+        """
+        ws = await self._connect()
+        context_id = uuid4().hex
+        queue = asyncio.Queue()
+        self._contexts[context_id] = queue
+
+        async def send_text():
+            # The opening message of a context carries the voice settings
+            await ws.send(json.dumps({"text": " ", "voice_settings": VOICE_SETTINGS, "context_id": context_id}))
+            async for chunk in text_chunks:
+                if chunk:
+                    await ws.send(json.dumps({"text": chunk, "context_id": context_id}))
+            # Flush the buffered text, then close the context; the socket stays open
+            await ws.send(json.dumps({"context_id": context_id, "flush": True}))
+            await ws.send(json.dumps({"context_id": context_id, "close_context": True}))
+
+        sender = asyncio.create_task(send_text())
+        try:
+            while (data := await queue.get()) is not None:
+                if data.get("error"):
+                    raise RuntimeError(f"ElevenLabs error: {data.get('message') or data['error']}")
+                if data.get("audio"):
+                    yield base64.b64decode(data["audio"])
+                if data.get("isFinal"):
+                    break
+            else:
+                raise ConnectionError("ElevenLabs socket closed before the clip finished")
+        finally:
+            sender.cancel()
+            self._contexts.pop(context_id, None)
+
+
+voice_sockets = {}  # voice ID -> VoiceSocket
+
+
+async def collect_speech(text_chunks, voice_id: str) -> list:
+    """Gather every audio chunk for the given text over the voice's shared socket."""
+    if voice_id not in voice_sockets:
+        voice_sockets[voice_id] = VoiceSocket(voice_id)
+    chunks = [chunk async for chunk in voice_sockets[voice_id].stream(text_chunks)]
+    if not chunks:
+        raise RuntimeError("ElevenLabs socket returned no audio")
+    return chunks
+
+
+async def stream_text_to_speech(text_chunks, voice_id: str) -> tuple[str, bytes, float]:
+    """Convert streamed text to speech using ElevenLabs as the text is produced.
+
+    Synthesis overlaps with generation, but playback starts once the whole clip
+    is ready. Returns the full text along with the MP3 audio bytes and duration.
+    """
     global eleven_client
 
-    if eleven_client is None:
-        print("ElevenLabs client not configured")
-        return None, 0
+    # Pump the text through a queue so the full text survives a websocket failure
+    parts = []
+    queue = asyncio.Queue()
 
-    try:
-        # Select voice based on persona (female for Priya, male for Rajesh)
-        if "Priya" in persona_name or "priya" in persona_name.lower():
-            voice_id = VOICE_IDS["female"]
-        else:
-            voice_id = VOICE_IDS["male"]
-
-        # Generate speech using ElevenLabs
-        response = eleven_client.text_to_speech.convert(
-            text=text,
-            voice_id=voice_id,
-            model_id="eleven_turbo_v2_5",  # Faster model, good quality
-            output_format="mp3_44100_128",
-            voice_settings={
-                "stability": 0.5,
-                "similarity_boost": 0.75,
-                "style": 0.0,
-                "speed": 1.15  # Slightly faster speech
-            }
-        )
+    async def pump_text():
+        async for chunk in text_chunks:
+            parts.append(chunk)
+            await queue.put(chunk)
+        await queue.put(None)
 
-        # Create temp file and write audio data
-        fd, filepath = tempfile.mkstemp(suffix='.mp3')
-        os.close(fd)
+    async def queued_text():
+        while (chunk := await queue.get()) is not None:
+            yield chunk
 
-        # Write the audio bytes to file
-        with open(filepath, 'wb') as f:
-            for chunk in response:
-                f.write(chunk)
+    pump = asyncio.create_task(pump_text())
 
-        audio_files.append(filepath)
+    try:
+        if eleven_client is None:
+            print("ElevenLabs client not configured")
+            await pump
+            return "".join(parts).strip(), None, 0
+
+        # Stream speech over the websocket; fall back to the REST endpoint if it fails
+        try:
+            response = await collect_speech(queued_text(), voice_id)
+            await pump
+            text = "".join(parts).strip()
+        except Exception as e:
+            print(f"TTS stream error, falling back to REST: {e}")
+            await pump
+            text = "".join(parts).strip()
+            response = [chunk async for chunk in eleven_client.text_to_speech.convert(
+                text=text,
+                voice_id=voice_id,
+                model_id=ELEVEN_MODEL_ID,
+                output_format=ELEVEN_OUTPUT_FORMAT,
+                optimize_streaming_latency=latency_mode_for(voice_id),
+                voice_settings=VOICE_SETTINGS
+            )]
+
+        # Keep the audio in memory; Gradio accepts the MP3 bytes directly
+        audio = b"".join(response)
 
         # Get audio duration (pass text for fallback estimation)
-        duration = get_audio_duration(filepath, text)
+        duration = get_audio_duration(len(audio), text)
 
-        return filepath, duration
+        return text, audio, duration
     except Exception as e:
         print(f"TTS Error: {e}")
-        return None, 0
+        await pump
+        return "".join(parts).strip(), None, 0
+    finally:
+        pump.cancel()
+
+
+async def text_to_speech(text: str, voice_id: str) -> tuple[bytes, float]:
+    """Convert text to speech using ElevenLabs and return the MP3 audio bytes and duration."""
+    async def single_chunk():
+        yield text
 
+    _, audio, duration = await stream_text_to_speech(single_chunk(), voice_id)
+    return audio, duration
 
-def wait_with_stop_check(duration: float, stop_event):
-    """Wait for duration while checking for stop signal every 0.1s."""
-    intervals = int(duration * 10)
-    for _ in range(intervals):
-        if stop_event.is_set():
-            break
-        time.sleep(0.1)
+
+def retain_audio(msg: dict):
+    """Track a message holding audio, releasing the audio of the oldest one past the window."""
+    if len(audio_messages) == audio_messages.maxlen:
+        # Evicted messages fall back to re-synthesis on replay
+        audio_messages[0].pop("audio", None)
+    audio_messages.append(msg)
+
+
+async def wait_with_stop_check(duration: float, stop_event) -> bool:
+    """Wait for duration or until stopped; return True if the stop signal fired."""
+    try:
+        await asyncio.wait_for(stop_event.wait(), timeout=duration)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+def format_chat_message(msg: dict) -> dict:
+    """Format a single conversation message for Gradio chatbot display."""
+    if msg["name"] == "Priya Sharma":
+        return {"role": "user", "content": f"**{msg['name']}**: {msg['content']}"}
+    return {"role": "assistant", "content": f"**{msg['name']}**: {msg['content']}"}
 
 
 def format_chat_for_display(history: list) -> list:
     """Format conversation history for Gradio chatbot display."""
-    messages = []
-    for msg in history:
-        if msg["name"] == "Priya Sharma":
-            messages.append({"role": "user", "content": f"**{msg['name']}**: {msg['content']}"})
-        else:
-            messages.append({"role": "assistant", "content": f"**{msg['name']}**: {msg['content']}"})
-    return messages
+    return [format_chat_message(msg) for msg in history]
 
 
-def generate_next_response_async(persona_name, persona_prompt, history, result_holder):
-    """Generate response in background thread."""
+async def generate_next_response(persona_name, persona_prompt, history):
+    """Generate the next response and its audio."""
     try:
         last_msg = history[-1]["content"] if history else ""
-        response = generate_response(persona_name, persona_prompt, history, last_msg)
-        audio_path, audio_duration = text_to_speech(response, persona_name)
-        result_holder['response'] = response
-        result_holder['audio_path'] = audio_path
-        result_holder['audio_duration'] = audio_duration
-        result_holder['done'] = True
+        # Feed Gemini's stream straight into TTS so synthesis starts with the first tokens
+        text_chunks = stream_response(persona_name, persona_prompt, history, last_msg)
+        return await stream_text_to_speech(text_chunks, PERSONA_VOICE[persona_name])
     except Exception as e:
-        result_holder['response'] = f"[Error: {str(e)}]"
-        result_holder['audio_path'] = None
-        result_holder['audio_duration'] = 0
-        result_holder['done'] = True
+        return f"[Error: {str(e)}]", None, 0
+
+
+async def lookahead_response(turn_task, history, speaker_name, persona_name, persona_prompt):
+    """Generate the reply to a pending turn as soon as that turn's text is known."""
+    # Shield the pending turn so cancelling the look-ahead doesn't cancel it too
+    response, _, _ = await asyncio.shield(turn_task)
+    projected = history + [{"name": speaker_name, "content": response}]
+    return await generate_next_response(persona_name, persona_prompt, projected)
 
 
-def run_conversation(persona_a_name, persona_a_prompt, persona_a_start,
-                     persona_b_name, persona_b_prompt, chatbot):
+async def run_conversation(persona_a_name, persona_a_prompt, persona_a_start,
+                           persona_b_name, persona_b_prompt, chatbot):
     """Run the conversation loop between two personas with parallel processing."""
-    global conversation_history, running
-    import concurrent.futures
+    global conversation_history, running, cache_run_id
 
     conversation_history = []
+    cache_run_id = uuid4().hex  # Each run generates afresh instead of replaying the last one
+    _formatted_messages.clear()
+    audio_messages.clear()
     running = True
     stop_event.clear()
+    assign_voices(persona_a_name, persona_b_name)
 
-    # Priya starts with her greeting
-    first_message = {
-        "name": persona_a_name,
-        "content": persona_a_start
-    }
-    conversation_history.append(first_message)
-
-    # Generate TTS for first message
-    audio_path, audio_duration = text_to_speech(persona_a_start, persona_a_name)
-
-    # Start pre-generating Rajesh's response while Priya's audio plays
-    next_result = {'done': False}
-    pre_gen_thread = threading.Thread(
-        target=generate_next_response_async,
-        args=(persona_b_name, persona_b_prompt, list(conversation_history), next_result)
-    )
-    pre_gen_thread.start()
-
-    yield (
-        format_chat_for_display(conversation_history),
-        audio_path,
-        gr.update(interactive=False),  # Disable start button
-        gr.update(interactive=True),   # Enable stop button
-        gr.update(interactive=False),  # Disable persona A name
-        gr.update(interactive=False),  # Disable persona A prompt
-        gr.update(interactive=False),  # Disable persona A start
-        gr.update(interactive=False),  # Disable persona B name
-        gr.update(interactive=False),  # Disable persona B prompt
-        "🔴 Conversation Running..."
-    )
-
-    # Wait for audio to finish
-    wait_with_stop_check(audio_duration, stop_event)
-
-    # Alternate between personas
-    current_persona = "B"  # Next is B (Rajesh responds to Priya)
-
-    while running and not stop_event.is_set():
-        # Wait for pre-generated response if not ready
-        while not next_result['done'] and not stop_event.is_set():
-            time.sleep(0.05)
-
-        if stop_event.is_set():
-            break
-
-        # Use pre-generated response
-        response = next_result['response']
-        audio_path = next_result['audio_path']
-        audio_duration = next_result['audio_duration']
-
-        if current_persona == "B":
-            new_message = {"name": persona_b_name, "content": response}
-            next_persona_name = persona_a_name
-            next_persona_prompt = persona_a_prompt
-            current_persona = "A"
-        else:
-            new_message = {"name": persona_a_name, "content": response}
-            next_persona_name = persona_b_name
-            next_persona_prompt = persona_b_prompt
-            current_persona = "B"
-
-        conversation_history.append(new_message)
-
-        # Start pre-generating next response in background
-        next_result = {'done': False}
-        pre_gen_thread = threading.Thread(
-            target=generate_next_response_async,
-            args=(next_persona_name, next_persona_prompt, list(conversation_history), next_result)
+    # Cancel in-flight generation however the generator ends, including when
+    # Gradio closes it because the client disconnected
+    next_task = lookahead = None
+    try:
+        # Priya starts with her greeting
+        audio, audio_duration = await text_to_speech(persona_a_start, PERSONA_VOICE[persona_a_name])
+        first_message = {
+            "name": persona_a_name,
+            "content": persona_a_start,
+            "audio": audio
+        }
+        conversation_history.append(first_message)
+        _formatted_messages.append(format_chat_message(first_message))
+        retain_audio(first_message)
+
+        # Start pre-generating Rajesh's response while Priya's audio plays,
+        # and look one turn further ahead to Priya's reply to it
+        next_task = asyncio.create_task(
+            generate_next_response(persona_b_name, persona_b_prompt, list(conversation_history))
         )
-        pre_gen_thread.start()
+        lookahead = asyncio.create_task(lookahead_response(
+            next_task, list(conversation_history), persona_b_name, persona_a_name, persona_a_prompt
+        ))
 
         yield (
-            format_chat_for_display(conversation_history),
-            audio_path,
-            gr.update(interactive=False),
-            gr.update(interactive=True),
-            gr.update(interactive=False),
-            gr.update(interactive=False),
-            gr.update(interactive=False),
-            gr.update(interactive=False),
-            gr.update(interactive=False),
+            _formatted_messages,
+            audio,
+            gr.update(interactive=False),  # Disable start button
+            gr.update(interactive=True),   # Enable stop button
+            gr.update(interactive=False),  # Disable persona A name
+            gr.update(interactive=False),  # Disable persona A prompt
+            gr.update(interactive=False),  # Disable persona A start
+            gr.update(interactive=False),  # Disable persona B name
+            gr.update(interactive=False),  # Disable persona B prompt
             "🔴 Conversation Running..."
         )
 
-        # Wait for audio to finish (next response generating in parallel)
-        wait_with_stop_check(audio_duration, stop_event)
+        # Wait for audio to finish
+        stopped = await wait_with_stop_check(audio_duration, stop_event)
+
+        # Alternate between personas
+        current_persona = "B"  # Next is B (Rajesh responds to Priya)
+
+        while running and not stopped:
+            # Wait for the pre-generated response, unless Stop is pressed first
+            stop_wait = asyncio.create_task(stop_event.wait())
+            await asyncio.wait({next_task, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+            stop_wait.cancel()
+
+            if stop_event.is_set():
+                break
+
+            # Use pre-generated response
+            response, audio, audio_duration = next_task.result()
+
+            if current_persona == "B":
+                new_message = {"name": persona_b_name, "content": response, "audio": audio}
+                speaker_prompt = persona_b_prompt
+                next_persona_name = persona_a_name
+                current_persona = "A"
+            else:
+                new_message = {"name": persona_a_name, "content": response, "audio": audio}
+                speaker_prompt = persona_a_prompt
+                next_persona_name = persona_b_name
+                current_persona = "B"
+
+            conversation_history.append(new_message)
+            _formatted_messages.append(format_chat_message(new_message))
+            retain_audio(new_message)
+
+            # The look-ahead was conditioned on exactly this turn, so it is the next
+            # response; chain a new look-ahead for the speaker's reply after that
+            next_task = lookahead
+            lookahead = asyncio.create_task(lookahead_response(
+                next_task, list(conversation_history), next_persona_name,
+                new_message["name"], speaker_prompt
+            ))
+
+            yield (
+                _formatted_messages,
+                audio,
+                gr.update(interactive=False),
+                gr.update(interactive=True),
+                gr.update(interactive=False),
+                gr.update(interactive=False),
+                gr.update(interactive=False),
+                gr.update(interactive=False),
+                gr.update(interactive=False),
+                "🔴 Conversation Running..."
+            )
 
-    running = False
-    return (
-        format_chat_for_display(conversation_history),
+            # Wait for audio to finish (next response generating in parallel)
+            if await wait_with_stop_check(audio_duration, stop_event):
+                break
+    finally:
+        for task in (next_task, lookahead):
+            if task is not None:
+                task.cancel()
+        running = False
+
+    yield (
+        _formatted_messages,
         None,
         gr.update(interactive=True),   # Enable start button
         gr.update(interactive=False),  # Disable stop button
@@ -378,7 +827,7 @@ def run_conversation(persona_a_name, persona_a_prompt, persona_a_start,
     )
 
 
-def stop_conversation():
+async def stop_conversation():
     """Stop the running conversation."""
     global running
     stop_event.set()
@@ -386,15 +835,127 @@ def stop_conversation():
     return gr.update(interactive=True), gr.update(interactive=False)
 
 
-def replay_audio(evt: gr.SelectData, history):
+async def replay_audio(evt: gr.SelectData, history):
     """Replay audio for a selected message."""
     if evt.index < len(conversation_history):
         msg = conversation_history[evt.index]
-        audio_path, _ = text_to_speech(msg["content"], msg["name"])
-        return audio_path
+        if msg.get("audio"):
+            return msg["audio"]
+
+        # No stored audio (e.g. batch transcripts): synthesize once per session
+        key = (msg["name"], msg["content"])
+        audio = replay_cache.get(key)
+        if audio is None:
+            voice_id = PERSONA_VOICE.get(msg["name"], VOICE_IDS["male"])
+            audio, _ = await text_to_speech(msg["content"], voice_id)
+            if audio:
+                replay_cache.put(key, audio)
+        return audio
     return None
 
 
+def run_conversation_batch(persona_a: dict, persona_b: dict, turns: int = 20) -> list:
+    """Generate an N-turn transcript offline with Gemini Batch Mode.
+
+    A single draft call writes the whole conversation, then every turn is
+    regenerated in persona from the draft turns before it, all in one batch job.
+    """
+    from google import genai as batch_genai  # google-genai SDK, only needed for Batch Mode
+
+    client = batch_genai.Client(api_key=get_api_key())
+    names = (persona_a["name"], persona_b["name"])
+    opening = {"name": persona_a["name"], "content": persona_a["start_message"]}
+
+    # Draft pass: the assumed history each batched turn is conditioned on
+    draft_prompt = (
+        f"Write a phone conversation of {turns} lines between {names[0]} and {names[1]}, "
+        f"alternating speakers. Start with {names[0]} saying: \"{opening['content']}\"\n"
+        f"Write every line as 'Name: text'.\n\n"
+        f"{names[0]}:\n{persona_a['system_prompt']}\n\n{names[1]}:\n{persona_b['system_prompt']}"
+    )
+    draft_text = client.models.generate_content(model=GEMINI_MODEL, contents=draft_prompt).text
+    draft = []
+    for line in draft_text.splitlines():
+        name, sep, content = line.partition(":")
+        name = name.strip().strip("*")
+        if sep and name in names:
+            draft.append({"name": name, "content": content.strip()})
+    # The real opening line replaces the drafted one
+    draft = [opening] + draft[1:]
+
+    # Every batched turn needs a full, strictly alternating history to condition on
+    if len(draft) < turns - 1:
+        raise ValueError(f"Draft has only {len(draft)} of the {turns - 1} lines needed")
+    for k, msg in enumerate(draft[:turns - 1]):
+        if msg["name"] != names[k % 2]:
+            raise ValueError(f"Draft line {k + 1} is by {msg['name']}, expected {names[k % 2]}")
+
+    # One request per turn, each with the draft history up to that turn
+    inline_requests = []
+    for k in range(1, turns):
+        persona = persona_b if k % 2 else persona_a
+        inline_requests.append({
+            "contents": [{"role": "user", "parts": [{"text": build_prompt(persona["name"], draft[:k])}]}],
+            "config": {"system_instruction": {"parts": [{"text": persona["system_prompt"]}]}},
+        })
+
+    job = client.batches.create(
+        model=GEMINI_MODEL,
+        src=inline_requests,
+        config={"display_name": f"{names[0]} x {names[1]} transcript"}
+    )
+    deadline = time.monotonic() + BATCH_TIMEOUT
+    while job.state.name not in BATCH_DONE_STATES:
+        if time.monotonic() > deadline:
+            client.batches.cancel(name=job.name)
+            raise TimeoutError(f"Batch job did not finish within {BATCH_TIMEOUT // 60} minutes")
+        time.sleep(BATCH_POLL_INTERVAL)
+        job = client.batches.get(name=job.name)
+    if job.state.name != "JOB_STATE_SUCCEEDED":
+        raise RuntimeError(f"Batch job ended in {job.state.name}")
+
+    # Stitch the regenerated turns onto the opening line
+    transcript = [opening]
+    for k, result in enumerate(job.dest.inlined_responses, start=1):
+        name = names[1] if k % 2 else names[0]
+        # Blocked responses come back with no text
+        text = result.response.text if result.response else None
+        if text:
+            content = text.strip()
+        else:
+            content = f"[Error generating response: {result.error or 'no text returned'}]"
+        transcript.append({"name": name, "content": content})
+    return transcript
+
+
+def generate_transcript(persona_a_name, persona_a_prompt, persona_a_start,
+                        persona_b_name, persona_b_prompt, turns):
+    """Generate a full transcript via Batch Mode and show it in the chat."""
+    global conversation_history
+    # A live run owns conversation_history and the chat view
+    if running:
+        return gr.update(), "⚠️ Stop the running conversation before generating a transcript"
+
+    persona_a = {"name": persona_a_name, "system_prompt": persona_a_prompt, "start_message": persona_a_start}
+    persona_b = {"name": persona_b_name, "system_prompt": persona_b_prompt}
+    try:
+        turns = int(turns)
+        if turns < 2:
+            raise ValueError("Turns must be at least 2")
+        assign_voices(persona_a_name, persona_b_name)
+        transcript = run_conversation_batch(persona_a, persona_b, turns)
+    except Exception as e:
+        return gr.update(), f"❌ Batch transcript failed: {str(e)}"
+    if running:
+        return gr.update(), "⚠️ A conversation started while the batch ran; transcript discarded"
+
+    conversation_history = transcript
+    return (
+        format_chat_for_display(conversation_history),
+        f"✅ Generated {len(conversation_history)}-turn transcript with Batch Mode"
+    )
+
+
 def save_api_key_to_env(api_key: str) -> str:
     """Save API key to .env file."""
     env_path = Path(__file__).parent / ".env"
@@ -414,13 +975,13 @@ def handle_api_key_submit(api_key: str):
         return (
             gr.update(value=""),  # Clear the input
             f"✅ {message} {save_msg}",
-            gr.update(interactive=True),  # Enable start button
+            gr.update(interactive=not running),  # Enable start button unless a run owns the state
         )
     else:
         return (
             gr.update(),  # Keep input
             f"❌ {message}",
-            gr.update(interactive=False),  # Disable start button
+            gr.update(interactive=model is not None and not running),  # Start stays available with a working key
         )
 
 
@@ -573,6 +1134,12 @@ with gr.Blocks(title="AI Persona Conversation Simulator") as app:
         )
         stop_btn = gr.Button("⏹️ Stop Conversation", variant="stop", size="lg", interactive=False)
 
+    # Offline transcript generation (no audio, cheaper Batch Mode pricing)
+    with gr.Accordion("📜 Generate Transcript (Batch Mode)", open=False):
+        with gr.Row():
+            batch_turns = gr.Number(label="Turns", value=20, precision=0, minimum=2, scale=1)
+            batch_btn = gr.Button("Generate N-turn Transcript", variant="secondary", scale=1)
+
     # Chat display
     chatbot = gr.Chatbot(
         label="Conversation",
@@ -617,6 +1184,15 @@ with gr.Blocks(title="AI Persona Conversation Simulator") as app:
         outputs=[start_btn, stop_btn]
     )
 
+    batch_btn.click(
+        fn=generate_transcript,
+        inputs=[
+            persona_a_name, persona_a_prompt, persona_a_start,
+            persona_b_name, persona_b_prompt, batch_turns
+        ],
+        outputs=[chatbot, status]
+    )
+
     # Click on message to replay audio
     chatbot.select(
         fn=replay_audio,